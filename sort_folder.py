@@ -17,16 +17,43 @@ import argparse
 # import Tkinter as tk
 import tkinter as tk
 import os
-import glob
 import sys
 import shutil
 import json
+import functools
+import errno
+import bisect
+import mmap
+import concurrent.futures
+import queue
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where --reflink falls back to copying.
+    fcntl = None
+try:
+    # Optional: parses a large data.json several times faster than the json module.
+    import orjson
+except ImportError:
+    orjson = None
 
 # from shutil import copyfile, move
 from PIL import ImageTk, Image
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 IMAGE_EXTENSIONS = set(['.jpg', '.jpeg', '.gif', '.tif', '.tiff', '.psd', '.bmp'])
+# For str.endswith, which checks all extensions in one call.
+_IMAGE_EXTENSIONS_TUPLE = tuple(IMAGE_EXTENSIONS)
+# Images are scaled to fit into this (width, height) and shown on a canvas of this size.
+DISPLAY_SIZE = (1000, 500)
+
+# link(2) and FICLONE ioctl errors that mean "not possible here, copy the bytes instead".
+_LINK_FALLBACK_ERRNOS = set([errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP])
+_REFLINK_FALLBACK_ERRNOS = set([errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.ENOTSUP, errno.EOPNOTSUPP])
+# From <linux/fs.h>: _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
 
 class ImageGui:
     """
@@ -34,17 +61,36 @@ class ImageGui:
     Useful, for sorting views into sub views or for removing outliers from the data.
     """
 
-    def __init__(self, master, labels, records, destination):
+    def __init__(self, master, labels, records, destination, copy_mode='copy'):
         """
         Initialise GUI
         :param master: The parent window
         :param labels: A list of labels that are associated with the images
         :param paths: A list of file paths to images
+        :param copy_mode: How voted images get into the label folders: 'copy', 'link' or 'reflink'
         :return:
         """
 
         # So we can quit the window from within the functions
         self.master = master
+        master.protocol("WM_DELETE_WINDOW", self.close)
+
+        # Copies run in a pool so voting does not block on disk I/O. Data writes
+        # get their own single worker so snapshots land on disk in vote order.
+        self._io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        self._data_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+        # The latest copy job for each output path, so copies to the same file run in vote order.
+        self._last_copy = {}
+
+        # Decode the image the user is likely to look at next while they look at this one.
+        self._decode_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._prefetch = {}
+        self._prefetch_step = 1
+
+        # Recently shown images, most recent last, so going back and forth does not re-decode.
+        self._thumb_cache = OrderedDict()
+        self._thumb_cache_size = 64
 
         # Extract the frame so we can draw stuff on it
         frame = tk.Frame(master)
@@ -58,7 +104,29 @@ class ImageGui:
         # self.paths = paths
         self.records = records
         self.destination = destination
+        self._copy_file = COPY_FUNCTIONS[copy_mode]
         self.data_path = os.path.join(destination, 'data.json')
+        # Create the output folders up front instead of on every vote. This also means copies and
+        # data writes can run in either order.
+        os.makedirs(destination, exist_ok=True)
+        self._label_dirs = {label: os.path.join(destination, label) for label in labels}
+        for label_dir in self._label_dirs.values():
+            os.makedirs(label_dir, exist_ok=True)
+
+        # Votes are appended to data.jsonl and folded into data.json every few hundred votes,
+        # so a vote costs one short line instead of rewriting every record.
+        self.log_path = os.path.join(destination, 'data.jsonl')
+        self._log_fp = open(self.log_path, 'a', buffering=1)
+        self._votes_since_compact = 0
+        self._compact_every = 500
+        # Votes wait here until there has been no vote for a moment, then go to the log in one write.
+        self._unwritten = []
+        self._write_after_id = None
+        self._write_delay_ms = 500
+        # ... but never hold a vote back longer than this, even while votes keep coming.
+        self._write_max_delay = 1.5
+        self._unwritten_since = None
+        self._write_data_snapshot(records)
 
         # Number of labels and paths
         self.n_labels = len(labels)
@@ -66,15 +134,20 @@ class ImageGui:
         self.n_records = len(records)
         # print(self.n_records)
         # print(self.records)
+        # Sorted indices of the records without a label, kept up to date by vote().
+        self._unlabeled = [i for i, record in enumerate(records) if record['label'] is None]
 
         # Set empty image container
         self.image_raw = None
-        self.image = None
-        self.image_panel = tk.Label(frame)
+        # One canvas and one Tk photo for the whole session; each image is pasted into them.
+        self._canvas = Image.new('RGB', DISPLAY_SIZE)
+        self.image = ImageTk.PhotoImage(self._canvas)
+        self.image_panel = tk.Label(frame, image=self.image)
 
         # set image container to first image
         # self.set_image(paths[self.index])
         self.set_image(records[self.index]['path'])
+        self._prefetch_image(self.index + self._prefetch_step)
 
         # Add progress label
         if isinstance(self.records[self.index]['label'], str):
@@ -115,19 +188,19 @@ class ImageGui:
             )
         )
         # self.buttons.append(tk.Button(frame, text="next im", width=10, height=1, fg='green', command=lambda l=label: self.move_next_image()))
-        for key, label in enumerate(labels, start=1):
+        # One vote command per label; partial binds the label now, where a plain lambda would
+        # see the last label of the loop. Number key n runs self._dispatch[n-1].
+        self._dispatch = [functools.partial(self.vote, label) for label in labels]
+        for key, (label, command) in enumerate(zip(labels, self._dispatch), start=1):
             self.buttons.append(
                 tk.Button(
                     frame,
                     text=f'{label} ({key})',
-                    command=lambda l=label: self.vote(l)
+                    command=command
                 )
             )
-            # I am not sure why this `l=label` is necessary, but it is.
-            #   command=lambda: self.vote(label)     ... uses whatever the value of label is at the time called.
-            #   command=lambda l=label: self.vote(l) ... uses whatever the value of label is at the time initialized.
-            # key bindings (so number pad can be used as shortcut)
-            master.bind(str(key), self.vote_key)
+        # key bindings (so number pad can be used as shortcut)
+        master.bind('<KeyPress>', self._dispatch_key)
 
         # Place progress label in grid
         row = 0
@@ -155,6 +228,8 @@ class ImageGui:
         self.progress_label.configure(text=progress_string)
 
     def _go_to_index(self, index):
+        # Only stepping back one image counts as browsing backwards; jumps prefetch forwards.
+        step = -1 if index == self.index - 1 else 1
         message = None
         if index >= self.n_records:
             self.index = self.n_records - 1
@@ -167,6 +242,11 @@ class ImageGui:
         self._update_text_display(message=message)
         # self.set_image(self.paths[self.index])
         self.set_image(self.records[self.index]['path'])
+        if step != self._prefetch_step:
+            # The user changed direction, so whatever we prefetched is stale.
+            self._prefetch_step = step
+            self._drop_prefetch(list(self._prefetch))
+        self._prefetch_image(self.index + step)
         # if self.index < self.n_paths:
         #     self.set_image(self.paths[self.index])
         # else:
@@ -190,11 +270,8 @@ class ImageGui:
         """
         Displays the first unlabeled image in the paths list.
         """
-        index = 0
-        while self.records[index]['label'] is not None:
-            index += 1
-            if index >= self.n_records:
-                break
+        # Past the last image (which shows a message there) if everything is labeled.
+        index = self._unlabeled[0] if self._unlabeled else self.n_records
         self._go_to_index(index)
 
     def set_image(self, path):
@@ -202,10 +279,49 @@ class ImageGui:
         Helper function which sets a new image in the image view
         :param path: path to that image
         """
-        image = self._load_image(path)
+        future = self._prefetch.pop(self.index, None)
+        image = self._thumb_cache.get(path)
+        if image is not None:
+            if future is not None:
+                future.cancel()
+        elif future is not None and not future.cancel():
+            # Already decoding (or done) in the background, so just wait for it.
+            image = future.result()
+        else:
+            image = self._load_image(path)
+        self._thumb_cache[path] = image
+        self._thumb_cache.move_to_end(path)
+        if len(self._thumb_cache) > self._thumb_cache_size:
+            # Nothing else refers to an evicted thumbnail (it was pasted into the canvas when
+            # shown), so free its pixels now.
+            _, evicted = self._thumb_cache.popitem(last=False)
+            evicted.close()
         self.image_raw = image
-        self.image = ImageTk.PhotoImage(image)
-        self.image_panel.configure(image=self.image)
+        # Centre the image on the canvas and upload it into the existing photo.
+        self._canvas.paste((0, 0, 0), (0, 0) + DISPLAY_SIZE)
+        offset = ((DISPLAY_SIZE[0] - image.size[0]) // 2, (DISPLAY_SIZE[1] - image.size[1]) // 2)
+        self._canvas.paste(image, offset)
+        self.image.paste(self._canvas)
+
+    def _prefetch_image(self, index, max_prefetch=3):
+        """
+        Starts decoding the image at index in the background, keeping at most max_prefetch
+        decodes around.
+        :param index: Index of the record to decode
+        """
+        if index < 0 or index >= self.n_records or index in self._prefetch:
+            return
+        if self.records[index]['path'] in self._thumb_cache:
+            return
+        self._prefetch[index] = self._decode_pool.submit(self._load_image, self.records[index]['path'])
+        self._drop_prefetch(list(self._prefetch)[:-max_prefetch])
+
+    def _drop_prefetch(self, indices):
+        """
+        Forgets the prefetched images at the given indices, cancelling decodes not started yet.
+        """
+        for index in indices:
+            self._prefetch.pop(index).cancel()
 
     def vote(self, label):
         """
@@ -215,55 +331,141 @@ class ImageGui:
         # input_path = self.paths[self.index]
         input_path = self.records[self.index]['path']
         print('[DEBUG] Button label: "{}"'.format(label))
+        if self.records[self.index]['label'] is None:
+            del self._unlabeled[bisect.bisect_left(self._unlabeled, self.index)]
         self.records[self.index]['label'] = label
-        # print(self.records[self.index])
-        self._copy_image(input_path, self.destination, label)
-        self._write_data(self.records, self.data_path)
+        print(json.dumps(self.records[self.index], indent=2))
+        output_path = os.path.join(self._label_dirs[label], self.records[self.index]['name'])
+        previous = self._last_copy.get(output_path)
+        self._last_copy[output_path] = self._submit(self._io_pool, self._copy_image, input_path, output_path, previous)
+        entry = {'index': self.index, 'path': input_path, 'label': label}
+        if not self._unwritten:
+            self._unwritten_since = time.monotonic()
+        self._unwritten.append(entry)
+        if time.monotonic() - self._unwritten_since >= self._write_max_delay:
+            self._flush_data()
+        else:
+            if self._write_after_id is not None:
+                self.master.after_cancel(self._write_after_id)
+            self._write_after_id = self.master.after(self._write_delay_ms, self._flush_data)
+        self._votes_since_compact += 1
+        if self._votes_since_compact >= self._compact_every:
+            self._compact_data()
         self.show_next_image()
 
-    def vote_key(self, event):
+    def _flush_data(self):
+        """
+        Schedules writing the votes collected since the last flush to the vote log.
         """
-        Processes voting via the number key bindings.
+        if self._write_after_id is not None:
+            self.master.after_cancel(self._write_after_id)
+            self._write_after_id = None
+        if self._unwritten:
+            self._submit(self._data_pool, self._write_data, self._unwritten)
+            self._unwritten = []
+
+    def _compact_data(self):
+        """
+        Schedules a rewrite of data.json with all votes so far, which empties the vote log.
+        """
+        self._flush_data()
+        self._votes_since_compact = 0
+        # Snapshot the records so later votes can't change them mid-write.
+        records_copy = [dict(record) for record in self.records]
+        self._submit(self._data_pool, self._write_data_snapshot, records_copy)
+
+    def close(self):
+        """
+        Waits for outstanding copies and writes, then closes the window.
+        """
+        self._drop_prefetch(list(self._prefetch))
+        self._compact_data()
+        concurrent.futures.wait(self._pending)
+        self._io_pool.shutdown()
+        self._data_pool.shutdown()
+        self._decode_pool.shutdown()
+        self._log_fp.close()
+        self.master.destroy()
+
+    def _submit(self, pool, fn, *args):
+        """
+        Runs fn(*args) on the given pool and keeps track of the future until it is done.
+        :return: The future
+        """
+        self._pending = [future for future in self._pending if not future.done()]
+        future = pool.submit(fn, *args)
+        future.add_done_callback(self._report_error)
+        self._pending.append(future)
+        return future
+
+    @staticmethod
+    def _report_error(future):
+        """
+        Prints the exception of a failed background task, which would otherwise be lost.
+        """
+        if future.exception() is not None:
+            print('[ERROR] {}'.format(future.exception()))
+
+    def _dispatch_key(self, event):
+        """
+        Processes voting via the number keys.
         :param event: The event contains information about which key was pressed
         """
-        pressed_key = int(event.char)
-        label = self.labels[pressed_key-1]
-        self.vote(label)
+        if event.char.isdecimal() and 1 <= int(event.char) <= self.n_labels:
+            self._dispatch[int(event.char) - 1]()
 
     @staticmethod
-    def _load_image(path, size=(800,600)):
+    def _load_image(path, size=(800,600), mmap_threshold=1000000):
         """
         Loads and resizes an image from a given path using the Pillow library
         :param path: Path to image
         :param size: Size of display image
+        :param mmap_threshold: Files larger than this many bytes are memory mapped, so Pillow's
+            seeks while reading TIFF/PSD metadata are served from the page cache without a syscall
+        :return: Resized image
+        """
+        # The resized image is a copy, so the full size image (and the map) can be closed
+        # straight away instead of waiting for the garbage collector.
+        if os.path.getsize(path) <= mmap_threshold:
+            with Image.open(path) as image:
+                return ImageGui._resize_image(image)
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with Image.open(mm) as image:
+                return ImageGui._resize_image(image)
+
+    @staticmethod
+    def _resize_image(image):
+        """
+        Resizes an opened image to fit the display size
+        :param image: Image as returned by Image.open
         :return: Resized image
         """
-        image = Image.open(path)
         # image = image.resize(size, Image.ANTIALIAS)
-        # From image-sorter2:
-        max_height = 500
-        img = image 
-        s = img.size
-        ratio = max_height / s[1]
-        image = img.resize((int(s[0]*ratio), int(s[1]*ratio)), Image.ANTIALIAS)
+        # From image-sorter2, but also limit the width so the image fits on the canvas:
+        s = image.size
+        ratio = min(DISPLAY_SIZE[0] / s[0], DISPLAY_SIZE[1] / s[1])
+        size = (max(1, int(s[0]*ratio)), max(1, int(s[1]*ratio)))
+        # Let JPEGs decode at a reduced scale (1/2 to 1/8) that is still at least `size`.
+        # This is a no-op for other formats.
+        image.draft(image.mode, size)
+        image = image.resize(size, Image.LANCZOS)
         return image
 
-    @staticmethod
-    def _copy_image(input_path, destination, label):
+    def _copy_image(self, input_path, output_path, previous=None):
         """
-        Copies a file to a new label folder using the shutil library. The file will be copied into a
-        subdirectory called label in the input folder.
+        Copies (or links, depending on the copy mode) a file to a new label folder. The output path
+        is in a subdirectory called label in the output folder, which was created in __init__.
         :param input_path: Path of the original image
-        :param label: The label
+        :param output_path: Path of the copy
+        :param previous: Future of an earlier copy to the same output path, if any
         """
-        _, file_name = os.path.split(input_path)
-        # output_path = os.path.join(dirname, label, file_name)
-        output_folder = os.path.join(destination, label)
-        output_path = os.path.join(output_folder, file_name)
-        os.makedirs(output_folder, exist_ok=True)
+        if previous is not None:
+            # Let the earlier vote finish writing this file first, so the last vote wins.
+            # It was queued before this job, so it is already running and cannot be waiting on us.
+            concurrent.futures.wait([previous])
         # print(" %s --> %s" % (file_name, label))
         print(" %s -> %s" % (input_path, output_path))
-        shutil.copyfile(input_path, output_path)
+        self._copy_file(input_path, output_path)
 
     # @staticmethod
     # def _move_image(input_path, destination, label):
@@ -283,25 +485,28 @@ class ImageGui:
     #     print(" %s -> %s" % (input_path, output_path))
     #     shutil.move(input_path, output_path)
 
-    def _write_data(self, records, path):
+    def _write_data(self, entries):
         """
-        Moves a file to a new label folder using the shutil library. The file will be moved into a
-        subdirectory called label in the input folder. This is an alternative to _copy_image, which is not
-        yet used, function would need to be replaced above.
-        :param input_path: Path of the original image
-        :param label: The label
+        Appends votes to the vote log. Runs on the data worker thread.
+        :param entries: The index, path and label of each vote
         """
-        # _, file_name = os.path.split(input_path)
-        # # output_path = os.path.join(dirname, label, file_name)
-        # output_folder = os.path.join(destination, label)
-        # output_path = os.path.join(output_folder, file_name)
-        # os.makedirs(output_folder, exist_ok=True)
-        # # print(" %s --> %s" % (file_name, label))
-        # print(" %s -> %s" % (input_path, output_path))
-        # shutil.move(input_path, output_path)
-        print(json.dumps(records[self.index], indent=2))
-        with open(path, 'w') as f:
-            json.dump(records, f, indent=2, sort_keys=True)
+        self._log_fp.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        self._log_fp.flush()
+
+    def _write_data_snapshot(self, records):
+        """
+        Atomically replaces data.json with a snapshot of the records and empties the vote log,
+        whose votes the snapshot includes. Runs on the data worker thread.
+        :param records: A copy of the records, not shared with the GUI
+        """
+        tmp_path = self.data_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            # One record per line: a fraction of the size of indent=2, and still easy to read.
+            f.write('[\n')
+            f.write(',\n'.join(json.dumps(record) for record in records))
+            f.write('\n]\n')
+        os.replace(tmp_path, self.data_path)
+        self._log_fp.truncate(0)
 
 
 # def make_folder(directory):
@@ -312,40 +517,206 @@ class ImageGui:
 #     if not os.path.exists(directory):
 #         os.makedirs(directory)
 
-def find_images(dirname):
+def copy_file(input_path, output_path):
+    '''
+    Copy the contents of input_path to output_path. shutil.copyfile already
+    moves the bytes in the kernel (sendfile on Linux, fcopyfile on macOS).
+    An existing output_path is replaced, not written through (see
+    _replace_file).
+    '''
+    if _same_file(input_path, output_path):
+        raise shutil.SameFileError('{!r} and {!r} are the same file'.format(input_path, output_path))
+    _replace_file(output_path, functools.partial(shutil.copyfile, input_path))
+
+def _same_file(input_path, output_path):
+    '''
+    Whether output_path exists and is the same file as input_path.
+    '''
+    return os.path.exists(output_path) and os.path.samefile(input_path, output_path)
+
+def _replace_file(output_path, write):
+    '''
+    Call write(tmp_path) to create the file under a temporary name next to
+    output_path, then rename it over output_path. An existing output_path is
+    never opened for writing: after --link it may be a hard link to one of
+    the user's originals, which would otherwise be overwritten too.
+    '''
+    tmp_path = '{}.{}.{}.tmp'.format(output_path, os.getpid(), threading.get_ident())
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def link_file(input_path, output_path):
     '''
-    Put all image file paths into a list
+    Hard link output_path to input_path, which costs the same for any file
+    size. Copies instead if the two paths are on different filesystems or
+    the filesystem has no hard links.
     '''
+    if _same_file(input_path, output_path):
+        # Already linked (voted twice for the same label), or sorting a label folder into itself.
+        return
+    try:
+        _replace_file(output_path, functools.partial(os.link, input_path))
+    except OSError as err:
+        if err.errno not in _LINK_FALLBACK_ERRNOS:
+            raise
+        copy_file(input_path, output_path)
+
+def reflink_file(input_path, output_path):
+    '''
+    Make output_path a copy-on-write clone of input_path with the FICLONE
+    ioctl (Linux, on btrfs, XFS and others that support it). No data is
+    copied until one of the files is changed. Copies instead where cloning
+    is not supported.
+    '''
+    if _same_file(input_path, output_path):
+        # Already the same file, so there is nothing to clone.
+        return
+    if fcntl is None or not sys.platform.startswith('linux'):
+        copy_file(input_path, output_path)
+        return
+
+    def clone(tmp_path):
+        with open(input_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+    try:
+        _replace_file(output_path, clone)
+    except OSError as err:
+        if err.errno not in _REFLINK_FALLBACK_ERRNOS:
+            raise
+        copy_file(input_path, output_path)
+
+# Ways to put a voted image into its label folder, selected with --copy/--link/--reflink.
+COPY_FUNCTIONS = {
+    'copy': copy_file,
+    'link': link_file,
+    'reflink': reflink_file,
+}
+
+def scan_folder(dirname):
+    '''
+    List one directory: return its subdirectories and the image files in it.
+    Uses os.scandir, whose entries already know whether they are directories,
+    so only symlinks need an extra stat. As glob's '**' did, symlinked
+    folders are followed, hidden files and folders are skipped, and
+    unreadable folders are treated as empty.
+    '''
+    subdirs = []
     image_paths = []
-    for path in glob.glob(os.path.join(dirname, '**'), recursive=True):
-        _, ext = os.path.splitext(path)
-        if os.path.isdir(path):
-            continue
-        elif ext.lower() in IMAGE_EXTENSIONS:
-            image_paths.append(path)
-        else:
-            pass
+    try:
+        with os.scandir(dirname) as it:
+            for entry in it:
+                name = entry.name
+                if name.startswith('.'):
+                    continue
+                elif entry.is_dir():
+                    subdirs.append(entry.path)
+                elif name.lower().endswith(_IMAGE_EXTENSIONS_TUPLE):
+                    image_paths.append(entry.path)
+    except OSError:
+        pass
+    return subdirs, image_paths
+
+def find_images(dirname, workers=1):
+    '''
+    Yield all image file paths below dirname. With more than one worker the
+    folders are listed concurrently, which helps when every listing is a
+    round trip to a network filesystem.
+    '''
+    if workers > 1:
+        yield from _find_images_parallel(dirname, workers)
+        return
+    stack = [dirname]
+    while stack:
+        subdirs, image_paths = scan_folder(stack.pop())
+        stack.extend(subdirs)
+        yield from image_paths
+
+def _find_images_parallel(dirname, workers):
+    '''
+    Walk dirname with a pool of threads sharing a queue of folders to list.
+    Returns the image paths found, in no particular order.
+    '''
+    folders = queue.Queue()
+    folders.put(dirname)
+    # Folders queued or being listed. When it drops to zero the walk is done.
+    outstanding = [1]
+    lock = threading.Lock()
+
+    def worker():
+        found = []
+        while True:
+            folder = folders.get()
+            if folder is None:
+                return found
+            subdirs, image_paths = scan_folder(folder)
+            found.extend(image_paths)
+            with lock:
+                outstanding[0] += len(subdirs) - 1
+                done = outstanding[0] == 0
+            for subdir in subdirs:
+                folders.put(subdir)
+            if done:
+                # Wake up every worker so they can exit.
+                for _ in range(workers):
+                    folders.put(None)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(worker) for _ in range(workers)]
+    image_paths = []
+    for future in futures:
+        image_paths.extend(future.result())
     return image_paths
 
 def init_records(image_paths):
     '''
     Initialize records with image paths and empty labels.
     '''
-    records = dict()
-    for i, path in enumerate(image_paths):
-        records[i] = {'path': path, 'label': None}
-    return records
+    return [{'path': path, 'name': os.path.basename(path), 'label': None} for path in image_paths]
 
 def load_records(path):
     '''
     Load records from json file.
     '''
-    with open(path, 'r') as f:
-        records = json.load(f)
-    # Convert keys to ints.
-    records = {int(k): v for k, v in records.items()}
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(path, 'rb') as f:
+        records = loads(f.read())
+    if isinstance(records, dict):
+        # Older data.json files store records keyed by their index.
+        records = [records[k] for k in sorted(records, key=int)]
+    for record in records:
+        # Older data.json files don't store the file name.
+        if 'name' not in record:
+            record['name'] = os.path.basename(record['path'])
+    # Replay votes logged since data.json was last written.
+    log_path = os.path.join(os.path.dirname(path), 'data.jsonl')
+    if os.path.exists(log_path):
+        with open(log_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    # Half-written last line from a crash.
+                    continue
+                index = entry['index']
+                if index < len(records) and records[index]['path'] == entry['path']:
+                    records[index]['label'] = entry['label']
     return records
 
+def existing_paths(paths, workers=16):
+    '''
+    Return the paths that exist. The checks run on a thread pool, as they
+    are one round trip each on a network filesystem.
+    '''
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        exists = list(pool.map(os.path.exists, paths))
+    return [path for path, path_exists in zip(paths, exists) if path_exists]
+
 def main():
 
     # Make input arguments
@@ -358,6 +729,12 @@ def main():
     parser.add_argument('--images', nargs='*', required=False)
     parser.add_argument('-f', '--input-folder', help='Find images in this directory.', required=False)
     parser.add_argument('-d', '--data', help='Path to data.json. (Continue from where you left off.)', required=False)
+    copy_group = parser.add_mutually_exclusive_group()
+    copy_group.add_argument('--copy', dest='copy_mode', action='store_const', const='copy', help='Copy voted images into the label folders (default).')
+    copy_group.add_argument('--link', dest='copy_mode', action='store_const', const='link', help='Hard link voted images instead of copying, if on the same filesystem.')
+    copy_group.add_argument('--reflink', dest='copy_mode', action='store_const', const='reflink', help='Clone voted images copy-on-write (btrfs, XFS), copying where unsupported.')
+    parser.set_defaults(copy_mode='copy')
+    parser.add_argument('--walk-workers', type=int, default=1, help='Threads for finding images in --input-folder. More than 1 helps on network filesystems.', required=False)
 
     args = parser.parse_args()
     print(args)
@@ -372,11 +749,12 @@ def main():
         records = init_records(image_paths)
     elif isinstance(args.input_folder, str):
         # Put all image file paths into a list
-        image_paths = find_images(args.input_folder)
+        image_paths = list(find_images(args.input_folder, workers=args.walk_workers))
         records = init_records(image_paths)
     elif isinstance(args.data, str):
         records = load_records(args.data)
-        image_paths = [rec['path'] for rec in records.values() if os.path.exists(rec['path'])]
+        # Only resumed sessions can point at files that have gone away since.
+        image_paths = existing_paths([rec['path'] for rec in records])
     # print(*image_paths, sep='\n')
 
     if not image_paths:
@@ -385,7 +763,7 @@ def main():
 
     # Start the GUI
     master = tk.Tk()
-    app = ImageGui(master, labels, records, output_folder)
+    app = ImageGui(master, labels, records, output_folder, copy_mode=args.copy_mode)
     master.mainloop()
 
     return 0